@@ -1,21 +1,100 @@
-from fastapi import FastAPI, File, Form, UploadFile
+from fastapi import FastAPI, File, Form, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 import json
+import re
 import base64
 from difflib import get_close_matches
 import boto3
-from PIL import Image
+from PIL import Image, UnidentifiedImageError
 import io
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.application import MIMEApplication
 import os
-from typing import List, Dict, Any, Optional, Tuple
+import time
+import asyncio
+import functools
+from contextlib import asynccontextmanager
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple, Callable, Deque
 import pandas as pd
 from botocore.config import Config
 
 app = FastAPI(root_path="/api")
 
+MODEL_CALL_WORKERS = int(os.getenv("MODEL_CALL_WORKERS", "16"))
+STAGE_TIMEOUT_S = float(os.getenv("STAGE_TIMEOUT_S", "30"))
+# Hedged backups and the degraded fallbacks cover failures; few retries keep abandoned workers short-lived.
+BEDROCK_MAX_ATTEMPTS = int(os.getenv("BEDROCK_MAX_ATTEMPTS", "2"))
+
+ANALYZE_DEADLINE_S = float(os.getenv("ANALYZE_DEADLINE_S", "90"))
+ESTIMATE_DEADLINE_S = float(os.getenv("ESTIMATE_DEADLINE_S", "45"))
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_DEFAULT_DELAY_S = float(os.getenv("HEDGE_DEFAULT_DELAY_S", "8"))
+HEDGE_MAX_FRACTION = float(os.getenv("HEDGE_MAX_FRACTION", "0.1"))
+# Held back from a call's hard timeout for each model call still to come in the same request.
+CALL_RESERVE_S = float(os.getenv("CALL_RESERVE_S", "3"))
+
+MB = 1024 * 1024
+MAX_IMAGES_PER_REQUEST = int(os.getenv("MAX_IMAGES_PER_REQUEST", "10"))
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", str(25 * MB)))
+MAX_REQUEST_BYTES = int(os.getenv("MAX_REQUEST_BYTES", str(100 * MB)))
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(64_000_000)))
+MAX_REQUEST_PIXELS = int(os.getenv("MAX_REQUEST_PIXELS", str(256_000_000)))
+MAX_JSON_BODY_BYTES = int(os.getenv("MAX_JSON_BODY_BYTES", str(1 * MB)))
+MAX_EMAIL_ATTACHMENT_BYTES = int(os.getenv("MAX_EMAIL_ATTACHMENT_BYTES", str(7 * MB)))
+# Shared across requests; sized to leave room for the app, KB and thread stacks inside the 1 GB task.
+INGEST_MEMORY_BUDGET_BYTES = int(os.getenv("INGEST_MEMORY_BUDGET_BYTES", str(400 * MB)))
+INGEST_QUEUE_TIMEOUT_S = float(os.getenv("INGEST_QUEUE_TIMEOUT_S", "15"))
+MAX_IMAGE_WIDTH = 1024
+
+# PIL refuses anything over twice this outright; between 1x and 2x we reject it ourselves in open_image.
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+class RequestSizeLimitMiddleware:
+    """
+    413s bodies over max_bytes (max_json_bytes for anything but multipart). Content-Length
+    is checked up front; chunked bodies are counted as they stream in, so they can't
+    bypass the limit.
+    """
+    def __init__(self, app, max_bytes: int, max_json_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.max_json_bytes = max_json_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        multipart = headers.get(b"content-type", b"").startswith(b"multipart/")
+        limit = self.max_bytes if multipart else self.max_json_bytes
+        detail = f"Request body exceeds {limit} bytes"
+        length = headers.get(b"content-length", b"")
+        if length.isdigit() and int(length) > limit:
+            await JSONResponse(status_code=413, content={"detail": detail})(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # FastAPI re-raises HTTPExceptions from body parsing, so this becomes a 413.
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+# Added before CORS so that 413s still carry CORS headers.
+app.add_middleware(RequestSizeLimitMiddleware, max_bytes=MAX_REQUEST_BYTES, max_json_bytes=MAX_JSON_BODY_BYTES)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], 
@@ -24,11 +103,27 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-config = Config(region_name="us-west-2", retries={"max_attempts": 10, "mode": "standard"})
+config = Config(
+    region_name="us-west-2",
+    retries={"max_attempts": BEDROCK_MAX_ATTEMPTS, "mode": "standard"},
+    # Non-streaming InvokeModel sends nothing until the whole answer is generated, so each attempt
+    # gets the full stage timeout; BEDROCK_MAX_ATTEMPTS bounds how long an abandoned call holds its worker.
+    connect_timeout=min(5.0, STAGE_TIMEOUT_S),
+    read_timeout=STAGE_TIMEOUT_S,
+    max_pool_connections=MODEL_CALL_WORKERS
+)
 bedrock_client = boto3.client("bedrock-runtime", config=config)
+# boto3 is blocking; model calls run here so independent stages overlap without starving the default executor.
+MODEL_EXECUTOR = ThreadPoolExecutor(max_workers=MODEL_CALL_WORKERS, thread_name_prefix="bedrock")
 
 MODEL_IMAGE = "anthropic.claude-3-haiku-20240307-v1:0"
 MODEL_TEXT = "anthropic.claude-3-sonnet-20240229-v1:0"
+# Backup requests go to these when set, otherwise they re-send to the primary model.
+MODEL_IMAGE_FALLBACK = os.getenv("MODEL_IMAGE_FALLBACK") or MODEL_IMAGE
+MODEL_TEXT_FALLBACK = os.getenv("MODEL_TEXT_FALLBACK") or MODEL_TEXT
+MODEL_LATENCIES: Dict[str, Deque[float]] = {}
+# One entry per recent attempt, True for backups; caps backups at HEDGE_MAX_FRACTION of traffic.
+RECENT_HEDGES: Deque[bool] = deque(maxlen=200)
 
 KB_ROWS: pd.DataFrame = pd.DataFrame()
 KB_MAP: Dict[Tuple[str, str, str, str], Dict[str, Any]] = {} 
@@ -120,12 +215,65 @@ def load_kb_s3(bucket: str = KB_BUCKET, key: str = KB_KEY):
 
     print(f"[KB] Loaded {len(KB_MAP)} rows from S3 {bucket}/{key}")
 
+# Bump when the description prompt, damage types or artifact layout change; old artifacts are then ignored.
+ARTIFACT_VERSION = 1
+ARTIFACT_KEY = os.getenv("ARTIFACT_KEY", f"{os.path.splitext(KB_KEY)[0]}.artifacts.v{ARTIFACT_VERSION}.json")
+
+DAMAGE_TYPES: Dict[str, List[str]] = {
+    "dent": ["dent", "ding", "bent", "deform"],
+    "scratch": ["scratch", "scuff", "scrape"],
+    "crack": ["crack", "fracture"],
+    "broken": ["broken", "shatter", "smash", "missing", "detached"],
+    "paint": ["paint", "chip", "peel"],
+    "general": [],
+}
+
+PRECOMPUTED_DESCRIPTIONS: Dict[str, Dict[str, str]] = {}
+PRECOMPUTED_LABOUR_DESCRIPTION: Optional[str] = None
+
+def classify_damage(context: str) -> str:
+    ctx = _norm(context).lower()
+    for damage_type, keywords in DAMAGE_TYPES.items():
+        # Keywords are stems ("dent" -> "dented"), so anchor only the start of the word.
+        if any(re.search(rf"\b{k}", ctx) for k in keywords):
+            return damage_type
+    return "general"
+
+def load_artifacts_s3(bucket: str = KB_BUCKET, key: str = ARTIFACT_KEY):
+    global PRECOMPUTED_LABOUR_DESCRIPTION
+
+    PRECOMPUTED_DESCRIPTIONS.clear()
+    PRECOMPUTED_LABOUR_DESCRIPTION = None
+    s3 = boto3.client("s3")
+    try:
+        obj = s3.get_object(Bucket=bucket, Key=key)
+        artifact = json.loads(obj["Body"].read())
+    except Exception as e:
+        print(f"[ARTIFACTS] Failed to read from S3 {bucket}/{key}: {e}")
+        return
+
+    if artifact.get("version") != ARTIFACT_VERSION:
+        print(f"[ARTIFACTS] Ignoring {bucket}/{key}: version {artifact.get('version')} != {ARTIFACT_VERSION}")
+        return
+    for comp_key, entry in artifact.get("descriptions", {}).items():
+        PRECOMPUTED_DESCRIPTIONS[comp_key] = entry.get("by_damage", {})
+    PRECOMPUTED_LABOUR_DESCRIPTION = artifact.get("labour_description")
+
+    print(f"[ARTIFACTS] Loaded descriptions for {len(PRECOMPUTED_DESCRIPTIONS)} components from S3 {bucket}/{key}")
+
+def precomputed_description(component: str, damage_context: str = "") -> Optional[str]:
+    by_damage = PRECOMPUTED_DESCRIPTIONS.get(_norm_key(component))
+    if not by_damage:
+        return None
+    return by_damage.get(classify_damage(damage_context)) or by_damage.get("general")
+
 print("[DEBUG] Loading KB from S3...")
 print(f"[DEBUG] Using S3 KB: bucket={KB_BUCKET}, key={KB_KEY}")
 load_kb_s3()  
 print(f"[DEBUG] KB_ROWS shape: {KB_ROWS.shape}")
 print(f"[DEBUG] KB_MAP keys sample: {list(KB_MAP.keys())[:5]}")
 print(f"[DEBUG] KB_COMPONENTS_BY_BMR keys sample: {list(KB_COMPONENTS_BY_BMR.keys())[:5]}")
+load_artifacts_s3()
 
 def normalize_component_name(name: str, kb_components: List[str]) -> str:
     raw_norm = _norm_key(name)
@@ -136,7 +284,7 @@ def normalize_component_name(name: str, kb_components: List[str]) -> str:
     match = get_close_matches(raw_norm, kb_norm_map.keys(), n=1, cutoff=0.6)
     return kb_norm_map[match[0]] if match else name
 
-def ai_generate_description_natural(component: str, damage_context: str = "") -> str:
+def ai_generate_description_natural(component: str, damage_context: str = "", model_id: str = MODEL_TEXT) -> str:
     system_prompt = (
         "You are an expert car damage inspector. "
         f"Write a detailed, 1-line sentence describing visible damage for this component: {component}. "
@@ -160,7 +308,7 @@ def ai_generate_description_natural(component: str, damage_context: str = "") ->
 
     try:
         resp = bedrock_client.invoke_model(
-            modelId=MODEL_TEXT,
+            modelId=model_id,
             contentType="application/json",
             accept="application/json",
             body=json.dumps(body).encode("utf-8")
@@ -181,6 +329,36 @@ def normalize_component_for_kb(component: str, brand: str, model: str, region: s
         return component  
     return normalize_component_name(component, kb_components)
 
+def kb_map_components(damages: List[str], brand: str, model: str, region: str) -> List[Dict[str, str]]:
+    """
+    Model-free stand-in for ai_map_components: synonyms plus fuzzy match against the KB.
+    """
+    return [{"detected": d, "standard": normalize_component_for_kb(d, brand, model, region)} for d in damages]
+
+def dedupe_mappings(mappings: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """
+    Keeps the first mapping per standard component, so fuzzy matches can't list a component twice.
+    """
+    seen = set()
+    cleaned_mappings = []
+    for m in mappings:
+        std = m["standard"] or m["detected"]
+        if std not in seen:
+            cleaned_mappings.append(m)
+            seen.add(std)
+    return cleaned_mappings
+
+def kb_exact_component(name: str, kb_components: List[str]) -> Optional[str]:
+    """
+    Synonym or exact KB name match only; unlike normalize_component_name there is no fuzzy step.
+    """
+    raw_norm = _norm_key(name)
+    for syn, kb_std in COMPONENT_SYNONYMS.items():
+        if _norm_key(syn) == raw_norm:
+            raw_norm = _norm_key(kb_std)
+            break
+    return next((c for c in kb_components if _norm_key(c) == raw_norm), None)
+
 def kb_lookup(brand: str, model: str, region: str, component: str) -> Optional[Dict[str, Any]]:
     key = (_norm_key(brand), _norm_key(model), _norm_key(region), _norm_key(component))
     if key in KB_MAP:
@@ -193,15 +371,108 @@ def kb_lookup(brand: str, model: str, region: str, component: str) -> Optional[D
                 return KB_MAP[(_b, _m, _r, comp)]
     return None
 
-def compress_image(file, max_size_kb=5000) -> str:
-    image = Image.open(file)
+class MemoryBudget:
+    """
+    Byte budget shared by all in-flight uploads. Callers wait for room (up to a timeout)
+    instead of overcommitting, then get a 503 so the client can retry.
+    """
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self._cond = asyncio.Condition()
+
+    async def _acquire(self, nbytes: int):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.used + nbytes <= self.limit)
+            self.used += nbytes
+
+    @asynccontextmanager
+    async def reserve(self, nbytes: int, timeout: Optional[float] = None):
+        # A single item larger than the whole budget still runs, but only on its own.
+        nbytes = min(nbytes, self.limit)
+        try:
+            await asyncio.wait_for(self._acquire(nbytes), timeout=INGEST_QUEUE_TIMEOUT_S if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail="Server is busy processing other uploads; please retry shortly.", headers={"Retry-After": "5"})
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self.used -= nbytes
+                self._cond.notify_all()
+
+INGEST_BUDGET = MemoryBudget(INGEST_MEMORY_BUDGET_BYTES)
+
+def upload_size(upload: UploadFile) -> int:
+    # Uploads are spooled to disk by the multipart parser; measure without reading them into memory.
+    upload.file.seek(0, os.SEEK_END)
+    size = upload.file.tell()
+    upload.file.seek(0)
+    return size
+
+def check_upload_sizes(uploads: List[UploadFile], max_count: int, max_each: int, max_total: int) -> List[int]:
+    if len(uploads) > max_count:
+        raise HTTPException(status_code=413, detail=f"At most {max_count} files per request")
+    sizes = [upload_size(u) for u in uploads]
+    for upload, size in zip(uploads, sizes):
+        if size > max_each:
+            raise HTTPException(status_code=413, detail=f"{upload.filename} exceeds {max_each // MB} MB")
+    if sum(sizes) > max_total:
+        raise HTTPException(status_code=413, detail=f"Uploads exceed {max_total // MB} MB in total")
+    return sizes
+
+def open_image(file) -> Image.Image:
+    """
+    Reads only the header and rejects decompression bombs; nothing is decoded yet.
+    """
+    try:
+        image = Image.open(file)
+    except Image.DecompressionBombError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UnidentifiedImageError:
+        raise HTTPException(status_code=400, detail="Uploaded file is not a supported image")
+    if image.width * image.height > MAX_IMAGE_PIXELS:
+        image.close()
+        raise HTTPException(status_code=413, detail=f"Image exceeds {MAX_IMAGE_PIXELS // 1_000_000} MP")
+    return image
+
+def open_images(uploads: List[UploadFile]) -> List[Image.Image]:
+    """
+    Checks every header and the per-request pixel total before any decoding or model call.
+    """
+    sources = []
+    try:
+        for upload in uploads:
+            sources.append(open_image(upload.file))
+        total = sum(src.width * src.height for src in sources)
+        if total > MAX_REQUEST_PIXELS:
+            raise HTTPException(status_code=413, detail=f"Images exceed {MAX_REQUEST_PIXELS // 1_000_000} MP in total")
+    except HTTPException:
+        for src in sources:
+            src.close()
+        raise
+    return sources
+
+def draft_for_compress(image: Image.Image):
+    # JPEG decoders can downscale while decoding, so large photos never materialise at full resolution.
+    if image.width > MAX_IMAGE_WIDTH:
+        image.draft("RGB", (MAX_IMAGE_WIDTH, int(image.height * MAX_IMAGE_WIDTH / image.width)))
+
+def decode_cost(image: Image.Image) -> int:
+    # Decoded frame plus an RGB copy, plus the resized frame, JPEG buffer and base64 string.
+    return image.width * image.height * 4 * 2 + MAX_IMAGE_WIDTH * MAX_IMAGE_WIDTH * 3 * 3
+
+def compress_image(source: Image.Image, max_size_kb=5000) -> str:
+    image = source
     if image.mode in ("RGBA", "P"):
         image = image.convert("RGB")
-    max_width = 1024
+    max_width = MAX_IMAGE_WIDTH
     if image.width > max_width:
         ratio = max_width / float(image.width)
         new_height = int(image.height * ratio)
         image = image.resize((max_width, new_height), Image.LANCZOS)
+    if image is not source:
+        source.close()
     buffer = io.BytesIO()
     image.save(buffer, format="JPEG", optimize=True, quality=85)
     size_kb = buffer.getbuffer().nbytes / 1024
@@ -209,10 +480,10 @@ def compress_image(file, max_size_kb=5000) -> str:
         buffer = io.BytesIO()
         image.save(buffer, format="JPEG", optimize=True, quality=70)
         size_kb = buffer.getbuffer().nbytes / 1024
-    buffer.seek(0)
-    return base64.b64encode(buffer.read()).decode()
+    image.close()
+    return base64.b64encode(buffer.getbuffer()).decode()
 
-def analyze_damage_image(encoded_image: str, visible_parts: List[str]) -> dict:
+def analyze_damage_image(encoded_image: str, visible_parts: List[str], model_id: str = MODEL_IMAGE) -> dict:
     prompt = f"""
     You are an expert car damage AI.
     The image shows the following components: {visible_parts}.
@@ -254,7 +525,7 @@ def analyze_damage_image(encoded_image: str, visible_parts: List[str]) -> dict:
         body=body,
         contentType="application/json",
         accept="application/json",
-        modelId=MODEL_IMAGE
+        modelId=model_id
     )
 
     result = json.loads(response["body"].read())
@@ -279,7 +550,7 @@ def analyze_damage_image(encoded_image: str, visible_parts: List[str]) -> dict:
             "summary": ""
         }
 
-def merge_summaries(prompt_text):
+def merge_summaries(prompt_text, model_id: str = MODEL_TEXT):
     body = {
         "anthropic_version": "bedrock-2023-05-31",
         "messages": [{"role": "user", "content": prompt_text}],
@@ -287,7 +558,7 @@ def merge_summaries(prompt_text):
         "max_tokens": 1024
     }
     response = bedrock_client.invoke_model(
-        modelId=MODEL_TEXT,
+        modelId=model_id,
         contentType="application/json",
         accept="application/json",
         body=json.dumps(body).encode("utf-8")
@@ -295,7 +566,7 @@ def merge_summaries(prompt_text):
     result = json.loads(response["body"].read())
     return result["content"][0]["text"].strip()
 
-def detect_visible_parts(encoded_image: str) -> List[str]:
+def detect_visible_parts(encoded_image: str, model_id: str = MODEL_IMAGE) -> List[str]:
     prompt = """
     You are an expert car damage AI.
     Look at the uploaded image and detect which car components are actually visible from this list:
@@ -318,7 +589,7 @@ def detect_visible_parts(encoded_image: str) -> List[str]:
         ]
     }
     resp = bedrock_client.invoke_model(
-        modelId=MODEL_IMAGE,
+        modelId=model_id,
         contentType="application/json",
         accept="application/json",
         body=json.dumps(body).encode("utf-8")
@@ -335,7 +606,8 @@ def ai_map_components(
     brand: str,
     model: str,
     region: str,
-    kb_components_for_bmr: List[str]
+    kb_components_for_bmr: List[str],
+    model_id: str = MODEL_TEXT
 ) -> List[Dict[str, str]]:
     """
     Returns list of {"detected": <raw>, "standard": <standard_component>}
@@ -366,7 +638,7 @@ def ai_map_components(
     }
 
     response = bedrock_client.invoke_model(
-        modelId=MODEL_TEXT,
+        modelId=model_id,
         contentType="application/json",
         accept="application/json",
         body=json.dumps(body).encode("utf-8")
@@ -395,7 +667,8 @@ def ai_estimate_component_cost(
     brand: str,
     model: str,
     region: str,
-    context_damage: Optional[str] = None
+    context_damage: Optional[str] = None,
+    model_id: str = MODEL_TEXT
 ) -> Optional[float]:
     """
     Ask Claude ONLY for a single component's cost (INR), deterministic.
@@ -420,7 +693,7 @@ def ai_estimate_component_cost(
         "max_tokens": 100
     }
     response = bedrock_client.invoke_model(
-        modelId=MODEL_TEXT,
+        modelId=model_id,
         contentType="application/json",
         accept="application/json",
         body=json.dumps(body).encode("utf-8")
@@ -435,14 +708,223 @@ def ai_estimate_component_cost(
         print("[AI COST] Failed to parse:", e, text)
         return None
 
+def ai_is_india(location: str, model_id: str = MODEL_TEXT) -> bool:
+    try:
+        is_india_prompt = f"""
+        You are a smart assistant. I will give you a location string.
+        Tell me if this location is in India.
+        Respond strictly in JSON: {{"isIndia": true}} or {{"isIndia": false}}.
+        Location: "{location}"
+        """
+        body_is_india = {
+            "anthropic_version": "bedrock-2023-05-31",
+            "messages": [{"role": "user", "content": is_india_prompt}],
+            "temperature": 0.0,
+            "max_tokens": 50
+        }
+        resp = bedrock_client.invoke_model(
+            modelId=model_id,
+            contentType="application/json",
+            accept="application/json",
+            body=json.dumps(body_is_india).encode("utf-8")
+        )
+        result = json.loads(resp["body"].read())
+        text_output = result["content"][0]["text"]
+        is_india_json = json.loads(text_output)
+        return bool(is_india_json.get("isIndia", False))
+    except Exception as e:
+        print("Failed to parse isIndia:", e)
+        return True
+
+async def call_model(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(MODEL_EXECUTOR, functools.partial(fn, *args, **kwargs))
+
+def template_description(component: str) -> str:
+    return f"{component} shows visible damage."
+
+class Deadline:
+    """
+    Wall-clock budget for one request, split across the model calls it still has to make.
+    `degraded` is set once any call is skipped or cut short for lack of budget.
+    """
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+        self.degraded = False
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def share(self, calls_left: int = 1) -> float:
+        """Even split of what is left; a soft target used to decide when to hedge."""
+        return self.remaining() / max(1, calls_left)
+
+    def budget(self, calls_left: int = 1) -> float:
+        """Hard timeout: everything left, minus a reserve for each call after this one."""
+        reserved = CALL_RESERVE_S * (max(1, calls_left) - 1)
+        return min(STAGE_TIMEOUT_S, max(self.share(calls_left), self.remaining() - reserved))
+
+def request_deadline(requested_ms: Any, default_s: float) -> Deadline:
+    try:
+        seconds = min(default_s, float(requested_ms) / 1000) if requested_ms is not None else default_s
+    except (TypeError, ValueError):
+        seconds = default_s
+    return Deadline(seconds)
+
+def hedge_delay(name: str) -> float:
+    samples = sorted(MODEL_LATENCIES.get(name, ()))
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_DELAY_S
+    idx = min(len(samples) - 1, int(len(samples) * HEDGE_PERCENTILE / 100))
+    return samples[idx]
+
+def hedge_allowed() -> bool:
+    return sum(RECENT_HEDGES) < max(1.0, HEDGE_MAX_FRACTION * len(RECENT_HEDGES))
+
+async def hedged_call(
+    fn: Callable[..., Any],
+    model_id: str,
+    fallback_model_id: str,
+    *args,
+    hedge_after: Optional[float] = None,
+    **kwargs
+) -> Any:
+    """
+    Calls fn(..., model_id=model_id); if it hasn't answered within the observed
+    HEDGE_PERCENTILE latency for fn (or hedge_after, if sooner), sends a backup to
+    fallback_model_id and returns whichever succeeds first. Backups are skipped
+    once they make up HEDGE_MAX_FRACTION of recent attempts.
+    """
+    name = fn.__name__
+    latencies = MODEL_LATENCIES.setdefault(name, deque(maxlen=200))
+    delay = hedge_delay(name) if hedge_after is None else min(hedge_delay(name), hedge_after)
+
+    async def attempt(mid: str) -> Any:
+        start = time.perf_counter()
+        try:
+            return await call_model(fn, *args, model_id=mid, **kwargs)
+        finally:
+            # Failed and abandoned attempts count too (as a lower bound), or slow periods would drag p95 down.
+            latencies.append(time.perf_counter() - start)
+
+    may_hedge = True
+    error: Optional[BaseException] = None
+    RECENT_HEDGES.append(False)
+    pending = {asyncio.ensure_future(attempt(model_id))}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending,
+                timeout=delay if may_hedge else None,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+            # Hedge on a slow primary, or retry on a distinct fallback model if the primary failed.
+            if may_hedge and (not done or fallback_model_id != model_id) and hedge_allowed():
+                RECENT_HEDGES.append(True)
+                print(f"[HEDGE] {name} on {model_id} {'failed' if done else 'slower than p%g' % HEDGE_PERCENTILE}; sending backup to {fallback_model_id}")
+                pending.add(asyncio.ensure_future(attempt(fallback_model_id)))
+            may_hedge = False
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def budgeted_call(
+    deadline: Deadline,
+    fn: Callable[..., Any],
+    *args,
+    model_id: str,
+    fallback_model_id: str,
+    default: Any = None,
+    calls_left: int = 1,
+    label: str = "",
+    **kwargs
+) -> Any:
+    timeout = deadline.budget(calls_left)
+    if timeout <= 0:
+        print(f"[DEADLINE] No budget left for {label or fn.__name__}; using fallback")
+        deadline.degraded = True
+        return default
+    try:
+        return await asyncio.wait_for(
+            hedged_call(fn, model_id, fallback_model_id, *args, hedge_after=min(deadline.share(calls_left), timeout / 2), **kwargs),
+            timeout=timeout
+        )
+    except asyncio.TimeoutError:
+        print(f"[DEADLINE] {label or fn.__name__} exceeded its {timeout:.1f}s budget; using fallback")
+        deadline.degraded = True
+        return default
+    except Exception as e:
+        # Throttling or model errors that survived the retries and the backup degrade the response, not fail it.
+        print(f"[DEADLINE] {label or fn.__name__} failed: {e}; using fallback")
+        deadline.degraded = True
+        return default
+
+async def run_stage_graph(
+    stages: Dict[str, Dict[str, Any]],
+    default_timeout: Optional[float] = STAGE_TIMEOUT_S,
+    on_timeout: Optional[Callable[[str], None]] = None
+) -> Tuple[Dict[str, Any], Dict[str, float]]:
+    """
+    Runs {name: {"fn": async fn(results), "deps": [...], "timeout": s, "default": v}}.
+    Each stage starts as soon as its deps finish; "timeout" may be a callable, evaluated then.
+    A timed-out stage yields "fallback"(results) if given, else its "default", and is
+    reported to on_timeout.
+    Returns (results by stage name, elapsed ms by stage name).
+    """
+    for name, spec in stages.items():
+        missing = [d for d in spec.get("deps", []) if d not in stages]
+        if missing:
+            raise ValueError(f"Stage {name} depends on unknown stages: {missing}")
+
+    results: Dict[str, Any] = {}
+    timings: Dict[str, float] = {}
+    tasks: Dict[str, asyncio.Task] = {}
+
+    async def run(name: str) -> Any:
+        spec = stages[name]
+        for dep in spec.get("deps", []):
+            await tasks[dep]
+        start = time.perf_counter()
+        timeout = spec.get("timeout", default_timeout)
+        if callable(timeout):
+            timeout = timeout()
+        try:
+            value = await asyncio.wait_for(spec["fn"](results), timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"[STAGE] {name} timed out; using fallback")
+            value = spec["fallback"](results) if "fallback" in spec else spec.get("default")
+            if on_timeout:
+                on_timeout(name)
+        timings[name] = round((time.perf_counter() - start) * 1000, 1)
+        results[name] = value
+        return value
+
+    for name in stages:
+        tasks[name] = asyncio.ensure_future(run(name))
+    try:
+        await asyncio.gather(*tasks.values())
+    except Exception:
+        for t in tasks.values():
+            t.cancel()
+        raise
+    return results, timings
+
 @app.post("/analyze")
 async def analyze(images: List[UploadFile] = File(...), meta: str = Form(...)):
     extra = json.loads(meta)
+    deadline = request_deadline(extra.get("deadlineMs") if isinstance(extra, dict) else None, ANALYZE_DEADLINE_S)
     all_metadata = []
     combined_damages = []
     brand, model = "unknown", "unknown"
 
     print(f"[DEBUG] Received {len(images)} images, meta={extra}")
+    check_upload_sizes(images, MAX_IMAGES_PER_REQUEST, MAX_IMAGE_BYTES, MAX_REQUEST_BYTES)
+    sources = open_images(images)
 
     exhaustive_parts = [
         "Dickey Panel", "Bumper Front", "Bumper Rear", "Bumper Holder Rear",
@@ -452,8 +934,26 @@ async def analyze(images: List[UploadFile] = File(...), meta: str = Form(...)):
     parts_str = ', '.join(exhaustive_parts)
 
     for idx, image in enumerate(images, start=1):
-        encoded_image = compress_image(image.file)
-        visible_parts = detect_visible_parts(encoded_image)
+        # Two calls per remaining image plus the final merge share what is left of the budget.
+        calls_left = 2 * (len(images) - idx + 1) + 1
+        if deadline.budget(calls_left) <= 0:
+            print(f"[DEADLINE] Budget exhausted; skipping images {idx}..{len(images)}")
+            deadline.degraded = True
+            break
+
+        source = sources[idx - 1]
+        draft_for_compress(source)
+        try:
+            async with INGEST_BUDGET.reserve(decode_cost(source)):
+                encoded_image = await asyncio.to_thread(compress_image, source)
+        finally:
+            source.close()
+        await image.close()
+        visible_parts = await budgeted_call(
+            deadline, detect_visible_parts, encoded_image,
+            model_id=MODEL_IMAGE, fallback_model_id=MODEL_IMAGE_FALLBACK,
+            default=exhaustive_parts, calls_left=calls_left, label=f"detect_visible_parts:{idx}"
+        )
 
         prompt = f"""
             You are an expert car damage AI. The uploaded image may contain multiple damaged components. 
@@ -472,7 +972,14 @@ async def analyze(images: List[UploadFile] = File(...), meta: str = Form(...)):
             Respond ONLY with JSON.
             """
 
-        metadata = analyze_damage_image(encoded_image, visible_parts)
+        metadata = await budgeted_call(
+            deadline, analyze_damage_image, encoded_image, visible_parts,
+            model_id=MODEL_IMAGE, fallback_model_id=MODEL_IMAGE_FALLBACK,
+            calls_left=calls_left - 1, label=f"analyze_damage_image:{idx}"
+        )
+        del encoded_image
+        if metadata is None:
+            continue
         all_metadata.append(metadata)
 
         print(f"[DEBUG] Image {idx}: metadata returned from Claude:")
@@ -509,13 +1016,20 @@ async def analyze(images: List[UploadFile] = File(...), meta: str = Form(...)):
         {chr(10).join(image_summaries)}
         """
 
-    damage_summary_merged = merge_summaries(merge_prompt)
+    damage_summary_merged = await budgeted_call(
+        deadline, merge_summaries, merge_prompt,
+        model_id=MODEL_TEXT, fallback_model_id=MODEL_TEXT_FALLBACK,
+        default=" ".join(image_summaries), label="merge_summaries"
+    )
     print(f"[DEBUG] Merged damage summary:\n{damage_summary_merged}")
 
     is_car = any(
         (m.get("brand") != "unknown" or m.get("model") != "unknown" or m.get("visible_damage"))
         for m in all_metadata
     )
+    if deadline.degraded and len(all_metadata) < len(images):
+        # Skipped images weren't looked at, so they can't count as "not a car".
+        is_car = True
     print(f"[DEBUG] isCar={is_car}")
     print(f"[DEBUG] Combined visible_damage={combined_damages}")
 
@@ -527,7 +1041,8 @@ async def analyze(images: List[UploadFile] = File(...), meta: str = Form(...)):
         "damageSummary": damage_summary_merged,
         "visible_damage": combined_damages,
         "brandEditable": brand == "unknown",
-        "modelEditable": model == "unknown"
+        "modelEditable": model == "unknown",
+        "degraded": deadline.degraded
     }
 
 @app.post("/send-email")
@@ -540,57 +1055,64 @@ async def send_email(
     ses = boto3.client("ses", region_name="us-west-2")
     from_email = "dhruv.chowdary@neenopal.com"
 
-    msg = MIMEMultipart('mixed')
-    msg['Subject'] = subject
-    msg['From'] = from_email
-    msg['To'] = to
-
-    image_html = ""
-    if images:
-        for idx, image in enumerate(images):
-            image_bytes = await image.read()
-            content_id = f"uploadedImage{idx}"
-
-            att = MIMEApplication(image_bytes)
-            att.add_header('Content-ID', f'<{content_id}>')
-            att.add_header(
-                'Content-Disposition',
-                'inline',
-                filename=os.path.basename(image.filename)
-            )
-            msg.attach(att)
-
-            image_html += f'<img src="cid:{content_id}" width="400"><br>'
-
-        if 'id="vehicle-info-marker"' in body:
-            body = body.replace(
-                '<h3 id="vehicle-info-marker">Vehicle Information</h3>',
-                f'<h3 id="vehicle-info-marker">Vehicle Information</h3>{image_html}',
-                1
+    sizes = check_upload_sizes(images or [], MAX_IMAGES_PER_REQUEST, MAX_EMAIL_ATTACHMENT_BYTES, MAX_EMAIL_ATTACHMENT_BYTES)
+    # Raw bytes, their base64 copy in the MIME part, and the serialised message all coexist briefly.
+    async with INGEST_BUDGET.reserve(sum(sizes) * 3):
+        msg = MIMEMultipart('mixed')
+        msg['Subject'] = subject
+        msg['From'] = from_email
+        msg['To'] = to
+
+        image_html = ""
+        if images:
+            for idx, image in enumerate(images):
+                image_bytes = await image.read()
+                await image.close()
+                content_id = f"uploadedImage{idx}"
+
+                att = MIMEApplication(image_bytes)
+                del image_bytes
+                att.add_header('Content-ID', f'<{content_id}>')
+                att.add_header(
+                    'Content-Disposition',
+                    'inline',
+                    filename=os.path.basename(image.filename)
+                )
+                msg.attach(att)
+
+                image_html += f'<img src="cid:{content_id}" width="400"><br>'
+
+            if 'id="vehicle-info-marker"' in body:
+                body = body.replace(
+                    '<h3 id="vehicle-info-marker">Vehicle Information</h3>',
+                    f'<h3 id="vehicle-info-marker">Vehicle Information</h3>{image_html}',
+                    1
+                )
+            else:
+                body += image_html
+
+        msg_body = MIMEMultipart('alternative')
+        htmlpart = MIMEText(body, 'html', 'utf-8')
+        msg_body.attach(htmlpart)
+        msg.attach(msg_body)
+
+        try:
+            response = ses.send_raw_email(
+                Source=from_email,
+                Destinations=[to],
+                RawMessage={'Data': msg.as_string()}
             )
-        else:
-            body += image_html
-
-    msg_body = MIMEMultipart('alternative')
-    htmlpart = MIMEText(body, 'html', 'utf-8')
-    msg_body.attach(htmlpart)
-    msg.attach(msg_body)
-
-    try:
-        response = ses.send_raw_email(
-            Source=from_email,
-            Destinations=[to],
-            RawMessage={'Data': msg.as_string()}
-        )
-        return {"success": True, "messageId": response["MessageId"]}
-    except Exception as e:
-        return {"success": False, "error": str(e)}
+            return {"success": True, "messageId": response["MessageId"]}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
 
 @app.post("/estimate")
 async def estimate(payload: dict):
     brand    = payload.get("brand") or payload.get("vehicle", {}).get("make") or "unknown"
     model    = payload.get("model") or payload.get("vehicle", {}).get("model") or "unknown"
     location = payload.get("location") or "unknown"
+    debug    = bool(payload.get("debug"))
+    deadline = request_deadline(payload.get("deadlineMs"), ESTIMATE_DEADLINE_S)
 
     damage_phrases: list[str] = []
     if isinstance(payload.get("visible_damage"), list):
@@ -611,116 +1133,181 @@ async def estimate(payload: dict):
 
     damage_phrases = list(dict.fromkeys(damage_phrases))
 
-    is_india = True
-    try:
-        is_india_prompt = f"""
-        You are a smart assistant. I will give you a location string.
-        Tell me if this location is in India.
-        Respond strictly in JSON: {{"isIndia": true}} or {{"isIndia": false}}.
-        Location: "{location}"
-        """
-        body_is_india = {
-            "anthropic_version": "bedrock-2023-05-31",
-            "messages": [{"role": "user", "content": is_india_prompt}],
-            "temperature": 0.0,
-            "max_tokens": 50
-        }
-        resp = bedrock_client.invoke_model(
-            modelId=MODEL_TEXT,
-            contentType="application/json",
-            accept="application/json",
-            body=json.dumps(body_is_india).encode("utf-8")
-        )
-        result = json.loads(resp["body"].read())
-        text_output = result["content"][0]["text"]
-        is_india_json = json.loads(text_output)
-        is_india = bool(is_india_json.get("isIndia", False))
-    except Exception as e:
-        print("Failed to parse isIndia:", e)
-
     kb_components_for_bmr = KB_COMPONENTS_BY_BMR.get((_norm_key(brand), _norm_key(model), _norm_key(location)), [])
 
-    mappings = ai_map_components(
-        damages=damage_phrases,
-        brand=brand, model=model, region=location,
-        kb_components_for_bmr=kb_components_for_bmr
-    )
-
-    if not mappings:
-        mappings = [{"detected": damage_phrases[0], "standard": "General Body Repair"}]
+    # Critical path is map -> per-item calls, and labour cost -> labour description.
+    # The KB only holds Indian workshop rates, so a KB hit for this brand/model/region settles both
+    # isIndia and (when every phrase names a KB component) the mapping without a model call.
+    async def stage_is_india(_results):
+        if kb_components_for_bmr:
+            return True
+        return await budgeted_call(
+            deadline, ai_is_india, location,
+            model_id=MODEL_TEXT, fallback_model_id=MODEL_TEXT_FALLBACK, default=True, label="is_india"
+        )
 
-    seen = set()
-    cleaned_mappings = []
-    for m in mappings:
-        std = m["standard"] or m["detected"]
-        if std not in seen:
-            cleaned_mappings.append(m)
-            seen.add(std)
-    mappings = cleaned_mappings
+    async def stage_map(_results):
+        exact = [kb_exact_component(d, kb_components_for_bmr) for d in damage_phrases]
+        if all(exact):
+            mappings = [{"detected": d, "standard": std} for d, std in zip(damage_phrases, exact)]
+        else:
+            mappings = await budgeted_call(
+                deadline, ai_map_components,
+                damages=damage_phrases,
+                brand=brand, model=model, region=location,
+                kb_components_for_bmr=kb_components_for_bmr,
+                model_id=MODEL_TEXT, fallback_model_id=MODEL_TEXT_FALLBACK, calls_left=2, label="map"
+            )
+            if mappings is None:
+                mappings = kb_map_components(damage_phrases, brand, model, location)
+        if not mappings:
+            mappings = [{"detected": damage_phrases[0], "standard": "General Body Repair"}]
+        return dedupe_mappings(mappings)
+
+    def kb_item(kb_entry: Dict[str, Any], desc: str) -> Dict[str, Any]:
+        subcosts = {
+            "part_cost": kb_entry.get("part_cost"),
+            "fitting_cost": kb_entry.get("fitting_cost"),
+            "dainting_cost": kb_entry.get("dainting_cost"),
+            "paint_cost": kb_entry.get("paint_cost"),
+            "other_cost": kb_entry.get("other_cost"),
+        }
+        component_total = _sum_costs(subcosts)
+        atpar_fields = [k for k, v in subcosts.items() if v is None]
+        return {
+            "row": {
+                "Component": kb_entry["component"],
+                "Description": desc,
+                "Cost (INR)": int(component_total) if component_total else 0,
+                "cost_source": "knowledge_base" if not atpar_fields else "knowledge_base_atpar"
+            },
+            "cost": component_total,
+            "note": f"{kb_entry['component']}: ATPAR for {', '.join(atpar_fields)} (requires inspection)." if atpar_fields else None
+        }
 
-    items: list[dict] = []
-    notes: list[str] = []
-    numeric_total = 0.0
-    sno = 1
+    def unavailable_item(standard: str, desc: str) -> Dict[str, Any]:
+        return {
+            "row": {
+                "Component": standard,
+                "Description": desc,
+                "Cost (INR)": 0,
+                "cost_source": "unavailable"
+            },
+            "cost": None,
+            "note": f"{standard}: cost unavailable; manual estimate required."
+        }
 
-    for m in mappings:
+    def fallback_items(results) -> List[Dict[str, Any]]:
+        # Model-free rows for when the whole items stage runs out of time: KB costs or "unavailable".
+        rows = []
+        for m in results["map"]:
+            detected = m["detected"]
+            standard = m["standard"] or detected
+            kb_entry = kb_lookup(brand, model, location, standard)
+            if kb_entry:
+                desc = precomputed_description(kb_entry['component'], detected) or template_description(kb_entry['component'])
+                rows.append(kb_item(kb_entry, desc))
+            else:
+                rows.append(unavailable_item(standard, template_description(detected)))
+        return rows
+
+    async def estimate_item(m: Dict[str, str]) -> Dict[str, Any]:
         detected = m["detected"]
         standard = m["standard"] or detected
 
         kb_entry = kb_lookup(brand, model, location, standard)
         if kb_entry:
-            subcosts = {
-                "part_cost": kb_entry.get("part_cost"),
-                "fitting_cost": kb_entry.get("fitting_cost"),
-                "dainting_cost": kb_entry.get("dainting_cost"),
-                "paint_cost": kb_entry.get("paint_cost"),
-                "other_cost": kb_entry.get("other_cost"),
-            }
-            component_total = _sum_costs(subcosts)
-            numeric_total += component_total if component_total else 0
-            atpar_fields = [k for k, v in subcosts.items() if v is None]
             print(kb_entry['component'], detected)
-            desc = ai_generate_description_natural(kb_entry['component'], detected)
-
-            items.append({
-                "SNo": sno,
-                "Component": kb_entry["component"],
-                "Description": desc,
-                "Cost (INR)": int(component_total) if component_total else 0,
-                "cost_source": "knowledge_base" if not atpar_fields else "knowledge_base_atpar"
-            })
-            if atpar_fields:
-                notes.append(f"{kb_entry['component']}: ATPAR for {', '.join(atpar_fields)} (requires inspection).")
-        else:
-            est_cost = ai_estimate_component_cost(standard, brand, model, location, detected)
-            numeric_total += est_cost if est_cost else 0
-            desc = ai_generate_description_natural(detected, standard)
-
-            items.append({
-                "SNo": sno,
+            desc = precomputed_description(kb_entry['component'], detected)
+            if desc is None:
+                desc = await budgeted_call(
+                    deadline, ai_generate_description_natural, kb_entry['component'], detected,
+                    model_id=MODEL_TEXT, fallback_model_id=MODEL_TEXT_FALLBACK,
+                    default=template_description(kb_entry['component']), label=f"description:{standard}"
+                )
+            return kb_item(kb_entry, desc)
+
+        est_cost, desc = await asyncio.gather(
+            budgeted_call(
+                deadline, ai_estimate_component_cost, standard, brand, model, location, detected,
+                model_id=MODEL_TEXT, fallback_model_id=MODEL_TEXT_FALLBACK, label=f"cost:{standard}"
+            ),
+            budgeted_call(
+                deadline, ai_generate_description_natural, detected, standard,
+                model_id=MODEL_TEXT, fallback_model_id=MODEL_TEXT_FALLBACK,
+                default=template_description(detected), label=f"description:{standard}"
+            )
+        )
+        return {
+            "row": {
                 "Component": standard,
                 "Description": desc,
                 "Cost (INR)": int(est_cost) if est_cost else 0,
                 "cost_source": "ai_generated" if est_cost else "unavailable"
-            })
-            if est_cost is None:
-                notes.append(f"{standard}: cost unavailable; manual estimate required.")
+            },
+            "cost": est_cost,
+            "note": f"{standard}: cost unavailable; manual estimate required." if est_cost is None else None
+        }
+
+    async def stage_items(results):
+        return await asyncio.gather(*[estimate_item(m) for m in results["map"]])
+
+    async def stage_labour_cost(_results):
+        labour_entry = kb_lookup(brand, model, location, "Labour")
+        if labour_entry:
+            return {"total": _sum_costs(labour_entry), "source": "knowledge_base"}
+        labour_total = await budgeted_call(
+            deadline, ai_estimate_component_cost, "Labour", brand, model, location, "General repair labour",
+            model_id=MODEL_TEXT, fallback_model_id=MODEL_TEXT_FALLBACK, calls_left=2, label="labour_cost"
+        )
+        return {"total": labour_total, "source": "ai_generated"}
+
+    async def stage_labour_desc(results):
+        if not results["labour_cost"]["total"]:
+            return None
+        if PRECOMPUTED_LABOUR_DESCRIPTION:
+            return PRECOMPUTED_LABOUR_DESCRIPTION
+        return await budgeted_call(
+            deadline, ai_generate_description_natural, "General repair", "Labour",
+            model_id=MODEL_TEXT, fallback_model_id=MODEL_TEXT_FALLBACK,
+            default=template_description("General repair"), label="labour_desc"
+        )
+
+    stages = {
+        "is_india": {"fn": stage_is_india, "default": True},
+        "map": {"fn": stage_map, "default": dedupe_mappings(kb_map_components(damage_phrases, brand, model, location))},
+        # Evaluated when the stage starts; the grace lets per-call fallbacks win over dropping every AI result.
+        "items": {"fn": stage_items, "deps": ["map"], "timeout": lambda: deadline.remaining() + 1.0, "fallback": fallback_items},
+        "labour_cost": {"fn": stage_labour_cost, "default": {"total": None, "source": "ai_generated"}},
+        "labour_desc": {"fn": stage_labour_desc, "deps": ["labour_cost"], "default": template_description("General repair")},
+    }
 
+    def mark_degraded(_name: str):
+        deadline.degraded = True
+
+    results, timings = await run_stage_graph(stages, default_timeout=deadline.remaining(), on_timeout=mark_degraded)
+    is_india = results["is_india"]
+
+    items: list[dict] = []
+    notes: list[str] = []
+    numeric_total = 0.0
+    sno = 1
+
+    for item in results["items"]:
+        items.append({"SNo": sno, **item["row"]})
+        numeric_total += item["cost"] if item["cost"] else 0
+        if item["note"]:
+            notes.append(item["note"])
         sno += 1
 
-    labour_entry = kb_lookup(brand, model, location, "Labour")
-    if labour_entry:
-        labour_total = _sum_costs(labour_entry)
-    else:
-        labour_total = ai_estimate_component_cost("Labour", brand, model, location, "General repair labour")
+    labour_total = results["labour_cost"]["total"]
     if labour_total:
-        labour_desc = ai_generate_description_natural("General repair", "Labour")
         items.append({
             "SNo": sno,
             "Component": "Labour",
-            "Description": labour_desc,
+            "Description": results["labour_desc"],
             "Cost (INR)": int(labour_total),
-            "cost_source": "knowledge_base" if labour_entry else "ai_generated"
+            "cost_source": results["labour_cost"]["source"]
         })
         numeric_total += labour_total
 
@@ -731,11 +1318,17 @@ async def estimate(payload: dict):
         paragraphs.extend([f"NOTE: {n}" for n in notes])
     if not is_india:
         paragraphs.append("NOTE: This estimate is calculated using India-based repair standards and costs. For locations outside India, the figures are approximate and meant for reference only.")
+    if deadline.degraded:
+        paragraphs.append("NOTE: Some AI steps were skipped to respond in time. Affected descriptions are generic, and items without a cost need a manual estimate.")
 
-    return {
+    response = {
         "currency": "₹",
         "items": items,
         "total": int(numeric_total),
         "paragraphs": paragraphs,
-        "isIndia": is_india
+        "isIndia": is_india,
+        "degraded": deadline.degraded
     }
+    if debug:
+        response["stageTimings"] = timings
+    return response
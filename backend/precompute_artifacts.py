@@ -0,0 +1,152 @@
+"""
+Offline job: generates canonical damage descriptions for every KB component and
+stores them as a versioned artifact next to the KB, so KB-hit estimates need no
+model calls. Re-run after each KB upload; only new or changed components and
+missing damage types are generated unless --force is given.
+
+    python precompute_artifacts.py [--bucket B] [--kb-key K] [--artifact-key A] [--force] [--dry-run]
+"""
+import argparse
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+import boto3
+
+import app
+from app import (
+    ARTIFACT_VERSION, DAMAGE_TYPES, MODEL_TEXT, MODEL_EXECUTOR,
+    _norm_key, ai_generate_description_natural, template_description
+)
+
+LABOUR_COMPONENT, LABOUR_CONTEXT = "General repair", "Labour"
+
+def damage_context(damage_type: str) -> str:
+    return "visible damage" if damage_type == "general" else f"{damage_type} damage"
+
+def component_fingerprint(component: str) -> str:
+    # Damage types are left out: adding one should only generate that type, not the whole component.
+    payload = {
+        "component": component,
+        "model": MODEL_TEXT,
+        "version": ARTIFACT_VERSION,
+    }
+    return hashlib.sha1(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+def labour_fingerprint() -> str:
+    payload = {
+        "component": LABOUR_COMPONENT,
+        "context": LABOUR_CONTEXT,
+        "model": MODEL_TEXT,
+        "version": ARTIFACT_VERSION,
+    }
+    return hashlib.sha1(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+def read_artifact(s3, bucket: str, key: str) -> Dict[str, Any]:
+    try:
+        obj = s3.get_object(Bucket=bucket, Key=key)
+        artifact = json.loads(obj["Body"].read())
+    except Exception as e:
+        print(f"[PRECOMPUTE] No usable artifact at {bucket}/{key} ({e}); starting fresh")
+        return {}
+    if artifact.get("version") != ARTIFACT_VERSION:
+        print(f"[PRECOMPUTE] Artifact version {artifact.get('version')} != {ARTIFACT_VERSION}; starting fresh")
+        return {}
+    return artifact
+
+def generate(component: str, context: str) -> Optional[str]:
+    text = ai_generate_description_natural(component, context)
+    # The generator swallows model errors and returns the template; don't persist those.
+    return None if text == template_description(component) else text
+
+def build_artifact(previous: Dict[str, Any], force: bool = False) -> Dict[str, Any]:
+    components: Dict[str, str] = {}
+    for entry in app.KB_MAP.values():
+        if _norm_key(entry["component"]) != _norm_key("Labour"):
+            components.setdefault(_norm_key(entry["component"]), entry["component"])
+
+    old = {} if force else previous.get("descriptions", {})
+    descriptions: Dict[str, Dict[str, Any]] = {}
+    jobs = []
+    for comp_key, component in components.items():
+        fingerprint = component_fingerprint(component)
+        entry = old.get(comp_key) or {}
+        by_damage = {}
+        if entry.get("fingerprint") == fingerprint:
+            by_damage = {d: text for d, text in entry.get("by_damage", {}).items() if d in DAMAGE_TYPES}
+        descriptions[comp_key] = {"component": component, "fingerprint": fingerprint, "complete": False, "by_damage": by_damage}
+        jobs.extend((comp_key, component, damage_type) for damage_type in DAMAGE_TYPES if damage_type not in by_damage)
+
+    pending = {comp_key for comp_key, _, _ in jobs}
+    removed = set(old) - set(components)
+    print(f"[PRECOMPUTE] {len(components)} components: {len(pending)} with {len(jobs)} descriptions to generate, "
+          f"{len(components) - len(pending)} unchanged, {len(removed)} removed")
+
+    futures = [
+        (comp_key, damage_type, MODEL_EXECUTOR.submit(generate, component, damage_context(damage_type)))
+        for comp_key, component, damage_type in jobs
+    ]
+    labour_description = None
+    if not force and previous.get("labour_fingerprint") == labour_fingerprint():
+        labour_description = previous.get("labour_description")
+    labour_future = None if labour_description else MODEL_EXECUTOR.submit(generate, LABOUR_COMPONENT, LABOUR_CONTEXT)
+
+    failed = 0
+    for comp_key, damage_type, future in futures:
+        text = future.result()
+        if text:
+            descriptions[comp_key]["by_damage"][damage_type] = text
+        else:
+            failed += 1
+    for entry in descriptions.values():
+        # Incomplete entries keep what was generated; the next run fills in only the missing types.
+        entry["complete"] = set(entry["by_damage"]) == set(DAMAGE_TYPES)
+    if labour_future:
+        labour_description = labour_future.result()
+        if not labour_description:
+            failed += 1
+    if failed:
+        print(f"[PRECOMPUTE] {failed} descriptions failed and will be retried on the next run")
+
+    return {
+        "version": ARTIFACT_VERSION,
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "model": MODEL_TEXT,
+        "damage_types": list(DAMAGE_TYPES),
+        "descriptions": descriptions,
+        "labour_description": labour_description,
+        # Left unset on failure so the next run retries it.
+        "labour_fingerprint": labour_fingerprint() if labour_description else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute KB description artifacts")
+    parser.add_argument("--bucket", default=app.KB_BUCKET)
+    parser.add_argument("--kb-key", default=app.KB_KEY)
+    parser.add_argument("--artifact-key", help="defaults to <kb-key stem>.artifacts.v<ARTIFACT_VERSION>.json")
+    parser.add_argument("--force", action="store_true", help="regenerate every description")
+    parser.add_argument("--dry-run", action="store_true", help="print the artifact instead of uploading it")
+    args = parser.parse_args()
+    if not args.artifact_key:
+        args.artifact_key = f"{os.path.splitext(args.kb_key)[0]}.artifacts.v{ARTIFACT_VERSION}.json"
+
+    if (args.bucket, args.kb_key) != (app.KB_BUCKET, app.KB_KEY):
+        app.load_kb_s3(args.bucket, args.kb_key)
+
+    if not app.KB_MAP:
+        print("[PRECOMPUTE] KB is empty; refusing to overwrite the artifact")
+        return
+
+    s3 = boto3.client("s3")
+    artifact = build_artifact(read_artifact(s3, args.bucket, args.artifact_key), force=args.force)
+    body = json.dumps(artifact, indent=2, ensure_ascii=False)
+    if args.dry_run:
+        print(body)
+        return
+    s3.put_object(Bucket=args.bucket, Key=args.artifact_key, Body=body.encode("utf-8"), ContentType="application/json")
+    print(f"[PRECOMPUTE] Wrote {len(artifact['descriptions'])} components to S3 {args.bucket}/{args.artifact_key}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import asyncio
+import io
+import json
+import os
+import sys
+import threading
+from collections import deque
+
+import pytest
+
+# app.py loads the KB from S3 at import; point it at a closed local port so it fails fast
+# and falls back to an empty KB instead of retrying against AWS.
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ.setdefault("AWS_EC2_METADATA_DISABLED", "true")
+os.environ.setdefault("AWS_ENDPOINT_URL_S3", "http://127.0.0.1:9")
+os.environ.setdefault("AWS_MAX_ATTEMPTS", "1")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+
+import app  # noqa: E402
+
+class FakeBedrock:
+    """
+    Stands in for bedrock_client, answering each prompt with the JSON its caller parses.
+    Set `fail_on` to a substring of a prompt to make matching calls raise instead.
+    """
+    def __init__(self, fail_on=None, error=None):
+        self.calls = 0
+        self.fail_on = fail_on
+        self.error = error
+        self._lock = threading.Lock()
+
+    def invoke_model(self, modelId, body, **kwargs):
+        with self._lock:
+            self.calls += 1
+        request = json.loads(body)
+        content = request["messages"][0]["content"]
+        prompt = request.get("system", "") + (content if isinstance(content, str) else content[-1]["text"])
+        if self.fail_on and self.fail_on in prompt:
+            raise self.error
+        if "visible_parts" in prompt:
+            text = json.dumps({"visible_parts": ["Bumper Front"]})
+        elif "parts_status" in prompt:
+            text = json.dumps({
+                "brand": "Maruti", "model": "Swift", "region": "unknown",
+                "parts_status": {"Bumper Front": "damaged"},
+                "summary": "Dented front bumper."
+            })
+        elif "isIndia" in prompt:
+            text = json.dumps({"isIndia": True})
+        elif "matched_components" in prompt:
+            damages = json.loads(content)["detected_damages"]
+            text = json.dumps({"matched_components": [{"detected": d, "standard": d} for d in damages]})
+        elif "cost" in prompt:
+            text = json.dumps({"cost": 4500})
+        else:
+            text = "The front bumper is dented."
+        return {"body": io.BytesIO(json.dumps({"content": [{"text": text}]}).encode("utf-8"))}
+
+@pytest.fixture
+def bedrock(monkeypatch):
+    fake = FakeBedrock()
+    monkeypatch.setattr(app, "bedrock_client", fake)
+    # asyncio primitives bind to the loop that first uses them; each test runs its own loop.
+    monkeypatch.setattr(app, "INGEST_BUDGET", app.MemoryBudget(app.INGEST_MEMORY_BUDGET_BYTES))
+    monkeypatch.setattr(app, "MODEL_LATENCIES", {})
+    monkeypatch.setattr(app, "RECENT_HEDGES", deque(maxlen=200))
+    return fake
+
+@pytest.fixture
+def run():
+    """Runs coro_fn(client) against the app (or asgi_app) over an in-process ASGI client."""
+    def run_client(coro_fn, asgi_app=None):
+        async def main():
+            transport = httpx.ASGITransport(app=asgi_app or app.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=120) as client:
+                return await coro_fn(client)
+        return asyncio.run(main())
+    return run_client
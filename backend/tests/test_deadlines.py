@@ -0,0 +1,138 @@
+import asyncio
+import io
+import json
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+from PIL import Image
+
+import app
+from conftest import FakeBedrock
+
+ESTIMATE_PAYLOAD = {
+    "brand": "Maruti", "model": "Swift", "location": "Pune",
+    "visible_damage": ["Bumper Front", "Bonnet Hood"],
+}
+ITEM_KEYS = {"SNo", "Component", "Description", "Cost (INR)", "cost_source"}
+
+def throttled(fail_on):
+    error = ClientError({"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}}, "InvokeModel")
+    return FakeBedrock(fail_on=fail_on, error=error)
+
+def by_model(delays, failures=()):
+    def fn(x, model_id):
+        time.sleep(delays.get(model_id, 0))
+        if model_id in failures:
+            raise RuntimeError(f"{model_id} failed")
+        return model_id
+    return fn
+
+def test_budget_uses_remaining_time_minus_reserve_and_share_splits_evenly(monkeypatch):
+    monkeypatch.setattr(app, "STAGE_TIMEOUT_S", 30.0)
+    monkeypatch.setattr(app, "CALL_RESERVE_S", 3.0)
+
+    deadline = app.Deadline(90)
+    assert deadline.share(21) == pytest.approx(90 / 21, abs=0.1)
+    assert deadline.budget(21) == pytest.approx(30, abs=0.1)
+
+    deadline = app.Deadline(10)
+    assert deadline.budget(1) == pytest.approx(10, abs=0.1)
+    assert deadline.budget(3) == pytest.approx(4, abs=0.1)
+    # The reserve never pushes the hard timeout below the even share.
+    assert deadline.budget(5) == pytest.approx(2, abs=0.1)
+
+    assert app.Deadline(0).budget(1) == 0
+
+def test_slow_primary_is_hedged_and_first_success_wins(bedrock):
+    fn = by_model({"primary": 2.0})
+
+    start = time.perf_counter()
+    result = asyncio.run(app.hedged_call(fn, "primary", "backup", 1, hedge_after=0.05))
+
+    assert result == "backup"
+    assert time.perf_counter() - start < 1.0
+    assert list(app.RECENT_HEDGES) == [False, True]
+
+def test_failed_primary_is_retried_on_a_different_fallback_model(bedrock):
+    fn = by_model({}, failures={"primary"})
+    assert asyncio.run(app.hedged_call(fn, "primary", "backup", 1, hedge_after=5)) == "backup"
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(app.hedged_call(fn, "primary", "primary", 1, hedge_after=5))
+
+def test_hedge_fraction_caps_backups(bedrock, monkeypatch):
+    monkeypatch.setattr(app, "HEDGE_MAX_FRACTION", 0.1)
+    fn = by_model({"primary": 0.3})
+
+    async def burst():
+        return await asyncio.gather(*[app.hedged_call(fn, "primary", "backup", 1, hedge_after=0.02) for _ in range(12)])
+
+    results = asyncio.run(burst())
+
+    hedges = sum(app.RECENT_HEDGES)
+    assert 0 < hedges <= app.HEDGE_MAX_FRACTION * len(app.RECENT_HEDGES) + 1
+    assert results.count("backup") == hedges
+    assert results.count("primary") == len(results) - hedges
+
+def test_budgeted_call_with_no_budget_returns_default_without_calling(bedrock):
+    calls = []
+    deadline = app.Deadline(0)
+
+    result = asyncio.run(app.budgeted_call(
+        deadline, lambda model_id: calls.append(model_id), model_id="primary", fallback_model_id="backup", default="fallback"
+    ))
+
+    assert result == "fallback"
+    assert deadline.degraded
+    assert calls == []
+
+def test_budgeted_call_degrades_when_the_model_raises(bedrock):
+    deadline = app.Deadline(10)
+    fn = by_model({}, failures={"primary"})
+
+    result = asyncio.run(app.budgeted_call(deadline, fn, 1, model_id="primary", fallback_model_id="primary", default="fallback"))
+
+    assert result == "fallback"
+    assert deadline.degraded
+
+def test_estimate_with_spent_deadline_returns_valid_degraded_response(bedrock, run):
+    response = run(lambda client: client.post("/estimate", json={**ESTIMATE_PAYLOAD, "deadlineMs": 0}))
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["degraded"] is True
+    assert [item["SNo"] for item in body["items"]] == list(range(1, len(body["items"]) + 1))
+    assert body["items"] and all(set(item) == ITEM_KEYS for item in body["items"])
+    assert len({item["Component"] for item in body["items"]}) == len(body["items"])
+    assert isinstance(body["total"], int) and isinstance(body["paragraphs"], list)
+    assert bedrock.calls == 0
+
+def test_estimate_survives_throttled_cost_calls(monkeypatch, bedrock, run):
+    fake = throttled(fail_on="estimate Indian automotive repair costs")
+    monkeypatch.setattr(app, "bedrock_client", fake)
+
+    response = run(lambda client: client.post("/estimate", json=ESTIMATE_PAYLOAD))
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["degraded"] is True
+    assert {item["cost_source"] for item in body["items"]} == {"unavailable"}
+    assert all("Description" in item for item in body["items"])
+
+def test_analyze_with_spent_deadline_returns_valid_degraded_response(bedrock, run):
+    photo = io.BytesIO()
+    Image.new("RGB", (64, 64), (140, 40, 40)).save(photo, "JPEG")
+
+    response = run(lambda client: client.post(
+        "/analyze",
+        files=[("images", ("tiny.jpg", photo.getvalue(), "image/jpeg"))],
+        data={"meta": json.dumps({"deadlineMs": 0})},
+    ))
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["degraded"] is True
+    assert body["isCar"] is True
+    assert set(body) >= {"brand", "model", "damageSummary", "visible_damage", "brandEditable", "modelEditable"}
+    assert bedrock.calls == 0
@@ -0,0 +1,99 @@
+import asyncio
+import json
+import resource
+import subprocess
+import sys
+
+import pytest
+
+import app
+
+# The backend task has 1 GB; leave headroom for the interpreter, pandas and uvicorn.
+RSS_LIMIT_MB = 700
+CONCURRENT_REQUESTS = 4
+
+# Generated in a subprocess so the full-resolution frames never count towards this process's RSS.
+MAKE_IMAGES = """
+import sys
+from PIL import Image
+Image.MAX_IMAGE_PIXELS = None
+out = sys.argv[1]
+photo = Image.new("RGB", (8000, 6000), (140, 40, 40))
+photo.save(out + "/photo.jpg", "JPEG", quality=85)
+photo.save(out + "/photo.png", "PNG")
+del photo
+Image.new("RGB", (64, 64), (10, 10, 10)).save(out + "/tiny.jpg", "JPEG")
+Image.new("1", (9000, 9000)).save(out + "/over_limit.png", "PNG")
+Image.new("1", (20000, 20000)).save(out + "/bomb.png", "PNG")
+"""
+
+@pytest.fixture(scope="module")
+def images(tmp_path_factory):
+    out = tmp_path_factory.mktemp("images")
+    subprocess.run([sys.executable, "-c", MAKE_IMAGES, str(out)], check=True)
+    return {p.name: p.read_bytes() for p in out.iterdir()}
+
+def post_analyze(client, files):
+    return client.post(
+        "/analyze",
+        files=[("images", (name, data, "application/octet-stream")) for name, data in files],
+        data={"meta": json.dumps({})},
+    )
+
+def test_concurrent_large_uploads_stay_under_rss_limit(images, bedrock, run, monkeypatch):
+    monkeypatch.setattr(app, "INGEST_QUEUE_TIMEOUT_S", 120)
+    files = [("photo.jpg", images["photo.jpg"]), ("photo.png", images["photo.png"])]
+
+    async def scenario(client):
+        return await asyncio.gather(*[post_analyze(client, files) for _ in range(CONCURRENT_REQUESTS)])
+
+    responses = run(scenario)
+
+    assert [r.status_code for r in responses] == [200] * CONCURRENT_REQUESTS
+    assert all(r.json()["isCar"] for r in responses)
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    assert peak_mb < RSS_LIMIT_MB, f"peak RSS {peak_mb:.0f} MB"
+
+def test_too_many_files_is_rejected(images, bedrock, run):
+    files = [("tiny.jpg", images["tiny.jpg"])] * (app.MAX_IMAGES_PER_REQUEST + 1)
+    response = run(lambda client: post_analyze(client, files))
+    assert response.status_code == 413
+    assert bedrock.calls == 0
+
+def test_oversized_file_is_rejected(images, bedrock, run, monkeypatch):
+    monkeypatch.setattr(app, "MAX_IMAGE_BYTES", len(images["tiny.jpg"]))
+    response = run(lambda client: post_analyze(client, [("tiny.jpg", images["tiny.jpg"]), ("photo.jpg", images["photo.jpg"])]))
+    assert response.status_code == 413
+    assert bedrock.calls == 0
+
+@pytest.mark.parametrize("name", ["over_limit.png", "bomb.png"])
+def test_pixel_bomb_is_rejected_before_any_model_call(images, bedrock, run, name):
+    response = run(lambda client: post_analyze(client, [("tiny.jpg", images["tiny.jpg"]), (name, images[name])]))
+    assert response.status_code == 413
+    assert bedrock.calls == 0
+
+def test_request_pixel_budget_is_enforced(images, bedrock, run):
+    count = app.MAX_REQUEST_PIXELS // (8000 * 6000) + 1
+    response = run(lambda client: post_analyze(client, [("photo.jpg", images["photo.jpg"])] * count))
+    assert response.status_code == 413
+    assert bedrock.calls == 0
+
+def test_full_budget_returns_503_with_retry_after(images, bedrock, run, monkeypatch):
+    monkeypatch.setattr(app, "INGEST_QUEUE_TIMEOUT_S", 0.1)
+    app.INGEST_BUDGET.used = app.INGEST_BUDGET.limit
+    response = run(lambda client: post_analyze(client, [("tiny.jpg", images["tiny.jpg"])]))
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "5"
+
+def test_chunked_body_without_length_is_counted(bedrock, run):
+    limited = app.RequestSizeLimitMiddleware(app.app, max_bytes=1024, max_json_bytes=1024)
+
+    async def chunks():
+        yield b'{"damageSummary": "'
+        for _ in range(8):
+            yield b"x" * 256
+        yield b'"}'
+
+    response = run(lambda client: client.post("/estimate", content=chunks(), headers={"content-type": "application/json"}), limited)
+    assert response.status_code == 413
+    assert bedrock.calls == 0
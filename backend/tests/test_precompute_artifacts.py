@@ -0,0 +1,52 @@
+import pytest
+
+import app
+import precompute_artifacts
+
+@pytest.fixture
+def generated(monkeypatch):
+    """Records each (component, context) generated; crack descriptions fail."""
+    calls = []
+
+    def generate(component, context):
+        calls.append((component, context))
+        return None if context == "crack damage" else f"{component}: {context}"
+
+    monkeypatch.setattr(precompute_artifacts, "generate", generate)
+    monkeypatch.setattr(app, "KB_MAP", {"a": {"component": "Bumper Front"}, "b": {"component": "Labour"}})
+    return calls
+
+def test_rerun_generates_only_missing_damage_types(generated):
+    first = precompute_artifacts.build_artifact({})
+    entry = first["descriptions"]["bumperfront"]
+    assert entry["fingerprint"] == precompute_artifacts.component_fingerprint("Bumper Front")
+    assert entry["complete"] is False
+    assert set(entry["by_damage"]) == set(app.DAMAGE_TYPES) - {"crack"}
+
+    generated.clear()
+    second = precompute_artifacts.build_artifact(first)
+    assert generated == [("Bumper Front", "crack damage")]
+    assert second["descriptions"]["bumperfront"]["by_damage"] == entry["by_damage"]
+
+def test_changed_fingerprint_regenerates_component(generated):
+    previous = precompute_artifacts.build_artifact({})
+    previous["descriptions"]["bumperfront"]["fingerprint"] = "stale"
+
+    generated.clear()
+    precompute_artifacts.build_artifact(previous)
+    assert sorted(generated) == sorted(
+        ("Bumper Front", precompute_artifacts.damage_context(d)) for d in app.DAMAGE_TYPES
+    )
+
+def test_labour_description_regenerates_when_its_fingerprint_changes(generated):
+    labour = (precompute_artifacts.LABOUR_COMPONENT, precompute_artifacts.LABOUR_CONTEXT)
+    previous = precompute_artifacts.build_artifact({})
+    assert previous["labour_fingerprint"] == precompute_artifacts.labour_fingerprint()
+
+    generated.clear()
+    precompute_artifacts.build_artifact(previous)
+    assert labour not in generated
+
+    generated.clear()
+    precompute_artifacts.build_artifact({**previous, "labour_fingerprint": "stale"})
+    assert labour in generated